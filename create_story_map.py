@@ -1,5 +1,6 @@
 # /create_story_map.py
 
+import json
 import yaml
 import logging
 from pathlib import Path
@@ -7,11 +8,33 @@ import geopandas as gpd
 import pandas as pd
 import numpy as np
 import folium
-from sklearn.preprocessing import MinMaxScaler
+from shapely.geometry import Point
+
+from src.data.make_dataset import load_primary_dataset
 
 # --- Configuración ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def _format_column(series: pd.Series, spec: str) -> list:
+    """Formatea una columna numérica a strings recorriendo directamente el arreglo de NumPy."""
+    return list(map(spec.format, series.to_numpy()))
+
+def _min_max_normalize(series: pd.Series) -> np.ndarray:
+    """Escala una columna al rango [0, 1] ignorando NaN; una columna constante se normaliza a 0."""
+    values = series.to_numpy(dtype=np.float64, copy=True)
+    v_min, v_max = np.nanmin(values), np.nanmax(values)
+    v_range = v_max - v_min
+    # Operaciones in-place sobre la copia para no crear arreglos temporales.
+    values -= v_min
+    values /= (v_range if v_range != 0 else 1.0)
+    return values
+
+def _compute_indice_equilibrio(densidad_norm: np.ndarray, tasa_norm: np.ndarray) -> np.ndarray:
+    """Calcula densidad_norm / (tasa_norm + 0.1) sobre arreglos de NumPy, sin alineación de índices."""
+    indice = tasa_norm + 0.1
+    np.divide(densidad_norm, indice, out=indice)
+    return indice
+
 def create_story_map():
     """
     Crea un mapa interactivo con múltiples capas, escalas de color por deciles
@@ -34,30 +57,45 @@ def create_story_map():
         return
         
     logging.info(f"Cargando dataset desde: {dataset_path}")
-    gdf = gpd.read_file(dataset_path)
+    gdf = load_primary_dataset(dataset_path)
 
-    # --- FIX 1: Cálculo del centro del mapa con .union_all() para eliminar el DeprecationWarning ---
-    map_center_proj = gdf.geometry.union_all().centroid
+    # --- FIX 1: Centro del mapa como promedio de centroides ponderado por área ---
+    # Equivale al centroide de la unión de polígonos sin tener que construir esa unión.
+    centroids = gdf.geometry.centroid
+    areas = gdf.geometry.area.to_numpy()
+    map_center_proj = Point(
+        np.average(centroids.x.to_numpy(), weights=areas),
+        np.average(centroids.y.to_numpy(), weights=areas)
+    )
     map_center_gdf = gpd.GeoSeries([map_center_proj], crs=gdf.crs).to_crs("EPSG:4326")
     map_center = [map_center_gdf.y.iloc[0], map_center_gdf.x.iloc[0]]
 
-    gdf_web = gdf.to_crs("EPSG:4326")
+    # Se evita reproyectar con PROJ si el dataset ya está en WGS84.
+    if gdf.crs is not None and gdf.crs.to_epsg() == 4326:
+        gdf_web = gdf.copy()
+    else:
+        gdf_web = gdf.to_crs("EPSG:4326")
 
     # --- 2. Feature Engineering y Formateo para Visualización ---
     logging.info("Creando 'Índice de Equilibrio' y formateando columnas para tooltip...")
-    scaler = MinMaxScaler()
-    gdf_web['densidad_negocios_norm'] = scaler.fit_transform(gdf_web[['densidad_negocios']])
-    gdf_web['tasa_delitos_km2_norm'] = scaler.fit_transform(gdf_web[['tasa_delitos_km2']])
-    gdf_web['indice_equilibrio'] = gdf_web['densidad_negocios_norm'] / (gdf_web['tasa_delitos_km2_norm'] + 0.1)
+    densidad_norm = _min_max_normalize(gdf_web['densidad_negocios'])
+    tasa_norm = _min_max_normalize(gdf_web['tasa_delitos_km2'])
+    gdf_web['densidad_negocios_norm'] = densidad_norm
+    gdf_web['tasa_delitos_km2_norm'] = tasa_norm
+    gdf_web['indice_equilibrio'] = _compute_indice_equilibrio(densidad_norm, tasa_norm)
 
     # --- FIX 2: Pre-formatear las columnas para el tooltip a strings ---
     # Se crean nuevas columnas con el formato deseado para evitar el error de serialización JSON.
-    gdf_web['pob_total_str'] = gdf_web['pob_total'].apply(lambda x: f"{x:,.0f}")
-    gdf_web['escolaridad_promedio_str'] = gdf_web['escolaridad_promedio'].apply(lambda x: f"{x:,.1f}")
-    gdf_web['num_negocios_str'] = gdf_web['num_negocios'].apply(lambda x: f"{x:,.0f}")
-    gdf_web['densidad_negocios_str'] = gdf_web['densidad_negocios'].apply(lambda x: f"{x:,.1f}")
-    gdf_web['tasa_delitos_km2_str'] = gdf_web['tasa_delitos_km2'].apply(lambda x: f"{x:,.1f}")
-    gdf_web['indice_equilibrio_str'] = gdf_web['indice_equilibrio'].apply(lambda x: f"{x:,.2f}")
+    tooltip_formats = {
+        'pob_total': "{:,.0f}",
+        'escolaridad_promedio': "{:,.1f}",
+        'num_negocios': "{:,.0f}",
+        'densidad_negocios': "{:,.1f}",
+        'tasa_delitos_km2': "{:,.1f}",
+        'indice_equilibrio': "{:,.2f}"
+    }
+    for col, spec in tooltip_formats.items():
+        gdf_web[col + '_str'] = _format_column(gdf_web[col], spec)
     
     # --- 3. Creación del Mapa Base ---
     m = folium.Map(location=map_center, zoom_start=11, tiles=None)
@@ -72,12 +110,27 @@ def create_story_map():
         {'col': 'escolaridad_promedio', 'name': 'Escolaridad Promedio', 'cmap': 'viridis'}
     ]
 
+    tooltip_fields = {
+        'nombre_unidad_territorial': 'Colonia:',
+        'pob_total_str': 'Población:',
+        'escolaridad_promedio_str': 'Escolaridad (años):',
+        'num_negocios_str': '# Negocios:',
+        'densidad_negocios_str': 'Densidad Negocios/km²:',
+        'tasa_delitos_km2_str': 'Tasa Delitos/km²:',
+        'indice_equilibrio_str': 'Índice Equilibrio:'
+    }
+
+    # Se serializa la geometría a GeoJSON una sola vez y se reutiliza en todas las capas.
+    # Sólo se incluyen la clave y los campos del tooltip: los valores de cada capa salen de 'data'.
+    geojson_cols = ['cve_unidad_territorial', *tooltip_fields.keys(), gdf_web.geometry.name]
+    geojson_dict = json.loads(gdf_web[geojson_cols].to_json())
+    decile_probs = np.linspace(0, 1, 11)
     for layer_info in layers_to_create:
         column = layer_info['col']
-        bins = sorted(list(set(gdf_web[column].quantile(np.linspace(0, 1, 11)))))
+        bins = np.unique(np.nanquantile(gdf_web[column].to_numpy(dtype=np.float64), decile_probs)).tolist()
         
         choropleth = folium.Choropleth(
-            geo_data=gdf_web,
+            geo_data=geojson_dict,
             name=layer_info['name'],
             data=gdf_web,
             columns=['cve_unidad_territorial', column],
@@ -92,15 +145,6 @@ def create_story_map():
         ).add_to(m)
         
         # --- FIX 3: Usar las nuevas columnas formateadas en el tooltip ---
-        tooltip_fields = {
-            'nombre_unidad_territorial': 'Colonia:',
-            'pob_total_str': 'Población:',
-            'escolaridad_promedio_str': 'Escolaridad (años):',
-            'num_negocios_str': '# Negocios:',
-            'densidad_negocios_str': 'Densidad Negocios/km²:',
-            'tasa_delitos_km2_str': 'Tasa Delitos/km²:',
-            'indice_equilibrio_str': 'Índice Equilibrio:'
-        }
         choropleth.geojson.add_child(
             folium.features.GeoJsonTooltip(
                 fields=list(tooltip_fields.keys()),
@@ -80,17 +80,29 @@ def main():
     logging.info("--- FASE 4: Creando y Uniendo Todos los Features a Nivel AGEB ---")
     denue_limpio_df = pd.read_parquet(denue_params['paths']['cleaned_output'])
     
-    agebs_con_features_economicos_gdf = create_economic_features_at_ageb_level(agebs_gdf, denue_limpio_df, params['crs_proyectado'])
-    agebs_con_features_seguridad_gdf = create_security_features_at_ageb_level(agebs_gdf, crime_df, params['crs_proyectado'], params['epsilon'])
+    # Proyección y área de los AGEBs una sola vez, compartidas por los features económicos y de seguridad.
+    agebs_proj_gdf = agebs_gdf.to_crs(params['crs_proyectado'])
+    agebs_proj_gdf['ageb_area_km2'] = agebs_proj_gdf['ageb_area_total'] / 1_000_000
+    # El STRtree se construye aquí una vez; ambas funciones consultan 'agebs_proj_gdf.sindex' directamente.
+    _ = agebs_proj_gdf.sindex
 
-    agebs_intermedio_gdf = agebs_con_censo_gdf.merge(
-        agebs_con_features_economicos_gdf[['cvegeo', 'num_negocios', 'indice_diversidad', 'densidad_negocios', 'densidad_diversidad']],
-        on='cvegeo', how='left'
+    agebs_con_features_economicos_gdf = create_economic_features_at_ageb_level(agebs_proj_gdf, denue_limpio_df, params['crs_proyectado'])
+    agebs_con_features_seguridad_gdf = create_security_features_at_ageb_level(agebs_proj_gdf, crime_df, params['crs_proyectado'], params['epsilon'])
+
+    # Unión alineada por índice 'cvegeo' en un solo paso, rellenando faltantes sin copiar el frame.
+    features_economicos = agebs_con_features_economicos_gdf.set_index('cvegeo')[
+        ['num_negocios', 'indice_diversidad', 'densidad_negocios', 'densidad_diversidad']
+    ]
+    features_seguridad = agebs_con_features_seguridad_gdf.set_index('cvegeo')[['tasa_delitos_km2']]
+    agebs_final_gdf = agebs_con_censo_gdf.set_index('cvegeo').join(
+        [features_economicos, features_seguridad], how='left'
     )
-    agebs_final_gdf = agebs_intermedio_gdf.merge(
-        agebs_con_features_seguridad_gdf[['cvegeo', 'tasa_delitos_km2']],
-        on='cvegeo', how='left'
-    ).fillna(0)
+    agebs_final_gdf.fillna(0, inplace=True)
+    agebs_final_gdf.reset_index(inplace=True)
+
+    # Los conteos se reducen al entero más angosto posible antes de la interpolación y la agregación.
+    for col in ['pob_total', 'viviendas_totales', 'viv_con_internet', 'num_negocios', 'indice_diversidad']:
+        agebs_final_gdf[col] = pd.to_numeric(agebs_final_gdf[col], downcast='integer')
 
     # --- FASE 5: INTERPOLACIÓN Y ENSAMBLAJE FINAL ---
     logging.info("--- FASE 5: Interpolando Todos los Features a Unidades Territoriales ---")
@@ -101,6 +113,8 @@ def main():
     # --- FASE 6: GUARDADO Y VALIDACIÓN ---
     final_output_path = Path(params['paths']['output']['primary_dataset'])
     final_gdf.to_file(final_output_path, driver='GPKG')
+    # Copia GeoParquet para que los scripts de consulta y visualización eviten el parseo con OGR.
+    final_gdf.to_parquet(final_output_path.with_suffix('.parquet'))
     logging.info(f"Dataset final guardado en: {final_output_path}")
 
     poblacion_calculada = final_gdf['pob_total'].sum()
@@ -4,7 +4,8 @@ import yaml
 import logging
 import argparse
 from pathlib import Path
-import geopandas as gpd
+
+from src.data.make_dataset import load_primary_dataset
 
 # --- Configuración de Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -34,7 +35,7 @@ def query_population_stats():
     if not dataset_path:
         return
 
-    final_gdf = gpd.read_file(dataset_path)
+    final_gdf = load_primary_dataset(dataset_path)
 
     if 'pob_total' not in final_gdf.columns:
         logging.error("La columna 'pob_total' no se encontró en el dataset final.")
@@ -61,7 +62,7 @@ def query_denue_stats():
     if not dataset_path:
         return
 
-    final_gdf = gpd.read_file(dataset_path)
+    final_gdf = load_primary_dataset(dataset_path)
     
     required_cols = ['num_negocios', 'indice_diversidad', 'densidad_negocios', 'nombre_unidad_territorial']
     if not all(col in final_gdf.columns for col in required_cols):
@@ -70,7 +71,7 @@ def query_denue_stats():
 
     total_negocios = final_gdf['num_negocios'].sum()
     avg_diversidad = final_gdf['indice_diversidad'].mean()
-    top_5_colonias = final_gdf.sort_values('num_negocios', ascending=False).head(5)
+    top_5_colonias = final_gdf.nlargest(5, 'num_negocios')
 
     print("\n" + "="*60)
     print("      RESUMEN DE CARACTERÍSTICAS ECONÓMICAS (DENUE)")
@@ -1,29 +1,38 @@
 # /src/data/make_dataset.py
 
 import pandas as pd
+import numpy as np
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyogrio
 from pathlib import Path
 import logging
+import os
 import re
 import zipfile
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from unidecode import unidecode
 from tqdm import tqdm
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def _build_cvegeo(ent: pd.Series, mun: pd.Series, loc: pd.Series, ageb: pd.Series) -> pd.Series:
+    """Construye la clave 'cvegeo' combinando aritméticamente entidad, municipio y localidad."""
+    # La clave AGEB puede ser alfanumérica (p. ej. '010A'), por eso sólo el prefijo numérico
+    # se arma con enteros y se formatea en una sola pasada.
+    prefijo = (ent.astype('int64') * 1_000 + mun.astype('int64')) * 10_000 + loc.astype('int64')
+    return prefijo.map('{:09d}'.format) + ageb.astype(str).str.zfill(4)
+
 def load_ageb_polygons(path: Path, target_crs: str) -> gpd.GeoDataFrame:
     """Carga los polígonos de AGEB, crea claves únicas y calcula el área."""
     logging.info(f"Cargando polígonos de AGEB desde: {path}")
     gdf = gpd.read_file(path)
     
     logging.info("Creando clave única 'cvegeo' de 15 dígitos.")
-    gdf['cvegeo'] = (
-        gdf['CVE_ENT'].astype(str).str.zfill(2) +
-        gdf['CVE_MUN'].astype(str).str.zfill(3) +
-        gdf['CVE_LOC'].astype(str).str.zfill(4) +
-        gdf['CVE_AGEB'].astype(str).str.zfill(4)
-    )
+    gdf['cvegeo'] = _build_cvegeo(gdf['CVE_ENT'], gdf['CVE_MUN'], gdf['CVE_LOC'], gdf['CVE_AGEB'])
 
     # --- INICIO DE LA CORRECCIÓN ---
     #
@@ -55,17 +64,15 @@ def load_and_process_census_data(path: Path, var_map: dict, num_cols: list, agg_
     df_manzanas = df[df['MZA'] != '000'].copy()
 
     logging.info("Creando clave 'cvegeo' a nivel de AGEB.")
-    df_manzanas['cvegeo'] = (
-        df_manzanas['ENTIDAD'].astype(str).str.zfill(2) +
-        df_manzanas['MUN'].astype(str).str.zfill(3) +
-        df_manzanas['LOC'].astype(str).str.zfill(4) +
-        df_manzanas['AGEB'].astype(str).str.zfill(4)
+    df_manzanas['cvegeo'] = _build_cvegeo(
+        df_manzanas['ENTIDAD'], df_manzanas['MUN'], df_manzanas['LOC'], df_manzanas['AGEB']
     )
 
     logging.info("Seleccionando, renombrando y limpiando variables de interés.")
     df_seleccion = df_manzanas[list(var_map.keys())].rename(columns=var_map)
     for col in num_cols:
-        df_seleccion[col] = pd.to_numeric(df_seleccion[col], errors='coerce')
+        # float32 basta para conteos y promedios por manzana y reduce a la mitad la memoria a mover.
+        df_seleccion[col] = pd.to_numeric(df_seleccion[col], errors='coerce').astype('float32')
 
     logging.info("Agrupando manzanas para calcular totales por AGEB.")
     df_agrupado = df_seleccion.groupby('cvegeo').agg(agg_map).reset_index()
@@ -81,41 +88,142 @@ def load_territorial_units(path: Path, target_crs: str) -> gpd.GeoDataFrame:
     return gdf
 
 
-def _parse_date_from_filename(filepath: Path, exception_map: dict) -> str | None:
-    """Extrae la fecha (YYYY-MM) del nombre de archivo."""
-    stem = filepath.stem
-    key = re.sub(r'\s*\(\d+\)$', '', stem)
+def load_primary_dataset(path: Path) -> gpd.GeoDataFrame:
+    """Carga el dataset final, prefiriendo su copia GeoParquet si existe junto al GPKG."""
+    parquet_path = path.with_suffix('.parquet')
+    if parquet_path.exists():
+        logging.info(f"Usando copia GeoParquet del dataset final: {parquet_path}")
+        return gpd.read_parquet(parquet_path)
+    return gpd.read_file(path)
+
+def load_primary_attributes(path: Path, columns: list) -> pd.DataFrame:
+    """Carga sólo columnas de atributos del dataset final, sin decodificar geometrías."""
+    parquet_path = path.with_suffix('.parquet')
+    if parquet_path.exists():
+        return pd.read_parquet(parquet_path, columns=columns)
+    return pyogrio.read_dataframe(path, columns=columns, read_geometry=False)
+
 
+_COPY_SUFFIX_RE = re.compile(r'\s*\(\d+\)$')
+_MMYY_RE = re.compile(r'(\d{2})(\d{2})')
+_YYYY_RE = re.compile(r'(\d{4})')
+_DENUE_PREFIX = 'denue_'
+
+@lru_cache(maxsize=2048)
+def _parse_date_from_key(key: str, exception_items: tuple) -> str | None:
+    """Extrae la fecha (YYYY-MM) de un nombre de archivo ya sin extensión ni sufijo de copia; se cachea."""
+    exception_map = dict(exception_items)
     if key in exception_map:
         return exception_map[key]
+
+    # Caso común 'denue_MMYY...': se resuelve con un slice antes de recurrir a las regex.
+    mmyy = key[len(_DENUE_PREFIX):len(_DENUE_PREFIX) + 4]
+    if key.startswith(_DENUE_PREFIX) and len(mmyy) == 4 and mmyy.isdigit():
+        month, year_short = mmyy[:2], mmyy[2:]
+        if 1 <= int(month) <= 12 and 15 <= int(year_short) <= 99:
+            return f'20{year_short}-{month}'
     
-    match = re.search(r'(\d{2})(\d{2})', key)
+    match = _MMYY_RE.search(key)
     if match:
         month, year_short = match.groups()
         if 1 <= int(month) <= 12 and 15 <= int(year_short) <= 99:
             return f'20{year_short}-{month}'
 
-    match = re.search(r'(\d{4})', key)
+    match = _YYYY_RE.search(key)
     if match:
         year = match.group(1)
         if 2010 <= int(year) <= 2025:
             return f'{year}-01'
-    
-    logging.warning(f"No se pudo determinar una fecha para el archivo: {filepath.name}.")
+
     return None
 
-def _standardize_columns(df: pd.DataFrame, column_mapping: dict) -> pd.DataFrame:
-    """Normaliza los nombres de las columnas usando unidecode y el mapeo."""
-    df.columns = [unidecode(col.lower().strip().lstrip('\ufeff')) for col in df.columns]
+def _parse_date_from_filename(filepath: Path, exception_items: tuple) -> str | None:
+    """Extrae la fecha (YYYY-MM) del nombre de archivo.
+
+    'exception_items' es el mapeo de excepciones como tupla ordenada de pares, para poder usarlo
+    como parte de la clave del caché.
+    """
+    # Se quita el sufijo de copia ('denue_0620 (1)') antes de consultar el caché, para que
+    # las copias de un mismo archivo compartan la entrada.
+    key = _COPY_SUFFIX_RE.sub('', filepath.stem)
+    date_key = _parse_date_from_key(key, exception_items)
+    if date_key is None:
+        logging.warning(f"No se pudo determinar una fecha para el archivo: {filepath.name}.")
+    return date_key
+
+def _normalize_column_name(col: str) -> str:
+    """Normaliza un nombre de columna del DENUE (minúsculas, sin acentos ni BOM)."""
+    return unidecode(col.lower().strip().lstrip('\ufeff'))
+
+def _build_inverted_column_map(column_mapping: dict) -> dict:
+    """Invierte el mapeo de columnas a {variante_normalizada: nombre_estandar}."""
+    return {
+        _normalize_column_name(p): standard_name
+        for standard_name, possible_names in column_mapping.items()
+        for p in possible_names
+    }
+
+def _standardize_columns(df: pd.DataFrame, inverted_map: dict) -> pd.DataFrame:
+    """Normaliza los nombres de las columnas usando unidecode y el mapeo invertido."""
+    df.columns = [_normalize_column_name(col) for col in df.columns]
     rename_dict = {}
-    for standard_name, possible_names in column_mapping.items():
-        normalized_variants = [unidecode(p.lower().strip()) for p in possible_names]
-        for col in df.columns:
-            if col in normalized_variants:
-                rename_dict[col] = standard_name
-                break
+    assigned = set()
+    for col in df.columns:
+        standard_name = inverted_map.get(col)
+        # Sólo la primera columna que coincide con cada nombre estándar se renombra.
+        if standard_name is not None and standard_name not in assigned:
+            rename_dict[col] = standard_name
+            assigned.add(standard_name)
     return df.rename(columns=rename_dict)
 
+def _read_denue_csv(zip_ref: zipfile.ZipFile, member: zipfile.ZipInfo, inverted_map: dict) -> pd.DataFrame:
+    """Lee sólo las columnas mapeadas de un CSV del DENUE, directamente desde el ZIP, como cadenas Arrow."""
+    with zip_ref.open(member) as fh:
+        header = pd.read_csv(fh, encoding='latin1', nrows=0).columns
+    usecols = [col for col in header if _normalize_column_name(col) in inverted_map]
+    with zip_ref.open(member) as fh:
+        table = pacsv.read_csv(
+            fh,
+            read_options=pacsv.ReadOptions(encoding='latin1'),
+            # Nombres y domicilios pueden traer saltos de línea entre comillas.
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=usecols,
+                column_types={col: pa.string() for col in usecols},
+                strings_can_be_null=True
+            )
+        )
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def _process_one_zip(zip_path: Path, column_mapping: dict, inverted_map: dict, exception_items: tuple) -> pd.DataFrame | None:
+    """Extrae y estandariza el CSV principal de un ZIP del DENUE."""
+    date_key = _parse_date_from_filename(zip_path, exception_items)
+    if not date_key:
+        return None
+
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            # Se lee el CSV más grande directamente del ZIP, sin extraer los archivos auxiliares.
+            csv_candidates = [
+                info for info in zip_ref.infolist()
+                if not info.is_dir() and info.filename.lower().endswith('.csv')
+            ]
+            if not csv_candidates:
+                return None
+
+            main_csv = max(csv_candidates, key=lambda info: info.file_size)
+            df = _read_denue_csv(zip_ref, main_csv, inverted_map)
+            df = _standardize_columns(df, inverted_map)
+            # Todas las filas de un ZIP comparten la fecha: se convierte una sola vez como escalar.
+            df['timestamp'] = pd.to_datetime(date_key, errors='coerce')
+            
+            cols_to_keep = list(column_mapping.keys())
+            existing_cols = [col for col in cols_to_keep if col in df.columns]
+            return df[existing_cols + ['timestamp']]
+    except Exception as e:
+        logging.error(f"Error procesando {zip_path.name}: {e}", exc_info=False)
+        return None
+
 def process_historical_denue_zips(zip_dir: Path, column_mapping: dict, exception_map: dict, output_path: Path):
     """Procesa archivos ZIP del DENUE, los consolida y guarda como Parquet."""
     logging.info("Iniciando consolidación de datos históricos del DENUE.")
@@ -128,31 +236,19 @@ def process_historical_denue_zips(zip_dir: Path, column_mapping: dict, exception
         logging.warning(f"No se encontraron archivos .zip en '{zip_dir}'.")
         return
 
+    inverted_map = _build_inverted_column_map(column_mapping)
+    process_zip = partial(
+        _process_one_zip,
+        column_mapping=column_mapping,
+        inverted_map=inverted_map,
+        exception_items=tuple(sorted(exception_map.items()))
+    )
     all_denue_dfs = []
-    for zip_path in tqdm(zip_files, desc="Procesando archivos ZIP del DENUE"):
-        date_key = _parse_date_from_filename(zip_path, exception_map)
-        if not date_key:
-            continue
-
-        try:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-                
-                csv_candidates = list(Path(temp_dir).rglob('*.csv'))
-                if not csv_candidates:
-                    continue
-
-                main_csv_path = max(csv_candidates, key=lambda p: p.stat().st_size)
-                df = pd.read_csv(main_csv_path, encoding='latin1', low_memory=False, dtype=str)
-                df = _standardize_columns(df, column_mapping)
-                df['timestamp'] = date_key
-                
-                cols_to_keep = list(column_mapping.keys())
-                existing_cols = [col for col in cols_to_keep if col in df.columns]
-                all_denue_dfs.append(df[existing_cols + ['timestamp']])
-        except Exception as e:
-            logging.error(f"Error procesando {zip_path.name}: {e}", exc_info=False)
+    # Cada ZIP es independiente, así que se reparten entre procesos para usar todos los núcleos.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for df in tqdm(executor.map(process_zip, zip_files), total=len(zip_files), desc="Procesando archivos ZIP del DENUE"):
+            if df is not None:
+                all_denue_dfs.append(df)
 
     if not all_denue_dfs:
         logging.info("No se procesaron datos del DENUE.")
@@ -162,31 +258,56 @@ def process_historical_denue_zips(zip_dir: Path, column_mapping: dict, exception
     denue_historico_df = pd.concat(all_denue_dfs, ignore_index=True)
     
     # Limpieza final y conversión de tipos
-    denue_historico_df['timestamp'] = pd.to_datetime(denue_historico_df['timestamp'], errors='coerce')
     for col in ['latitud', 'longitud']:
         if col in denue_historico_df.columns:
-            denue_historico_df[col] = pd.to_numeric(denue_historico_df[col], errors='coerce')
+            # float32 conserva ~1 m de precisión en coordenadas de la CDMX, suficiente a escala AGEB.
+            denue_historico_df[col] = pd.to_numeric(denue_historico_df[col], errors='coerce').astype('float32')
     
-    denue_historico_df.dropna(subset=['timestamp', 'latitud', 'longitud'], inplace=True)
-    denue_historico_df = denue_historico_df[
-        (denue_historico_df['latitud'].between(-90, 90)) &
-        (denue_historico_df['longitud'].between(-180, 180))
-    ]
+    # Una sola máscara para nulos y rangos válidos; las comparaciones con NaN ya resultan en False.
+    lat = denue_historico_df['latitud'].to_numpy(dtype=np.float64, na_value=np.nan)
+    lon = denue_historico_df['longitud'].to_numpy(dtype=np.float64, na_value=np.nan)
+    mask = (
+        (lat >= -90) & (lat <= 90) &
+        (lon >= -180) & (lon <= 180) &
+        denue_historico_df['timestamp'].notna().to_numpy()
+    )
+    denue_historico_df = denue_historico_df.loc[mask]
 
     logging.info(f"Guardando DENUE histórico consolidado en '{output_path}'...")
-    denue_historico_df.to_parquet(output_path, index=False)
+    # Diccionario sólo en columnas de baja cardinalidad y compresión ZSTD para lecturas posteriores más rápidas.
+    dictionary_cols = [
+        col for col in ['personal_ocupado_estrato', 'cve_scian', 'codigo_postal', 'cve_ageb']
+        if col in denue_historico_df.columns
+    ]
+    denue_historico_df.to_parquet(
+        output_path,
+        index=False,
+        engine='pyarrow',
+        compression='zstd',
+        compression_level=3,
+        use_dictionary=dictionary_cols,
+        row_group_size=256_000
+    )
 
 def load_and_filter_crime_data(path: Path, high_impact_categories: list) -> pd.DataFrame:
     """Carga los datos de crimen, seleccionando columnas clave y filtrando por alto impacto."""
     logging.info(f"Cargando datos de crimen desde: {path}")
     try:
-        df_crimen_raw = pd.read_csv(
-            path, 
-            usecols=['categoria_delito', 'latitud', 'longitud'],
-            dtype={'categoria_delito': 'category', 'latitud': 'float64', 'longitud': 'float64'}
+        tabla_crimen = pacsv.read_csv(
+            path,
+            # Los campos de texto libre pueden traer saltos de línea entre comillas.
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=['categoria_delito', 'latitud', 'longitud'],
+                column_types={'categoria_delito': pa.string(), 'latitud': pa.float64(), 'longitud': pa.float64()}
+            )
+        )
+        # El filtro de categoría y de coordenadas nulas se evalúa en Arrow, antes de materializar en pandas.
+        mascara = pc.and_(
+            pc.is_in(tabla_crimen['categoria_delito'], value_set=pa.array(high_impact_categories, type=pa.string())),
+            pc.and_(pc.is_valid(tabla_crimen['latitud']), pc.is_valid(tabla_crimen['longitud']))
         )
-        df_crimen_filtrado = df_crimen_raw[df_crimen_raw['categoria_delito'].isin(high_impact_categories)].copy()
-        df_crimen_filtrado.dropna(subset=['latitud', 'longitud'], inplace=True)
+        df_crimen_filtrado = tabla_crimen.filter(mascara).to_pandas(strings_to_categorical=True)
         logging.info(f"Se conservaron {len(df_crimen_filtrado):,} registros de delitos de alto impacto.")
         return df_crimen_filtrado
     except Exception as e:
@@ -3,13 +3,14 @@
 import pandas as pd
 import geopandas as gpd
 import logging
-from io import StringIO
 
 def inspect_df(df, title="Data Inspector"):
     """Imprime un resumen de diagnóstico para un DataFrame o GeoDataFrame."""
-    buf = StringIO()
-    df.info(buf=buf, show_counts=True)
-    info_str = buf.getvalue()
+    n_rows = len(df)
+    info_str = '\n'.join(
+        f"    {col}: {dtype} non-null={count:,}/{n_rows:,}"
+        for col, dtype, count in zip(df.columns, df.dtypes, df.count())
+    ) + '\n'
 
     report = f"""
     ===============================================================
@@ -20,7 +21,7 @@ def inspect_df(df, title="Data Inspector"):
     Filas:    {df.shape[0]:,}
     Columnas: {df.shape[1]}
 
-    --- 2. TIPOS DE DATOS Y NULOS (desde .info()) ---
+    --- 2. TIPOS DE DATOS Y NULOS ---
 {info_str}
     --- 3. VISTA PREVIA (primeras 3 filas) ---
 {df.head(3).to_string()}
@@ -55,6 +56,14 @@ def inspect_column(series: pd.Series, title="Column Inspector"):
     except ValueError: # Ocurre si la serie está vacía
         type_counts = "La columna no tiene valores no nulos para analizar."
 
+    # Se calculan una sola vez los conteos que reutiliza el reporte
+    non_null_count = series.count()
+    n_unique = series.nunique()
+    if pd.api.types.is_float_dtype(series) and n_unique > 10_000:
+        top_values = "Omitido: columna flotante de alta cardinalidad."
+    else:
+        top_values = series.value_counts().head(10).to_string()
+
     # Intenta obtener estadísticas descriptivas
     try:
         desc_stats = series.describe().to_string()
@@ -70,15 +79,15 @@ def inspect_column(series: pd.Series, title="Column Inspector"):
     Nombre de la Columna: '{series.name}'
     Tipo de Dato (Dtype): {series.dtype}
     Total de Elementos:   {len(series):,}
-    Valores No Nulos:     {series.count():,}
-    Valores Nulos:        {series.isnull().sum():,}
-    Valores Únicos:       {series.nunique():,}
+    Valores No Nulos:     {non_null_count:,}
+    Valores Nulos:        {len(series) - non_null_count:,}
+    Valores Únicos:       {n_unique:,}
 
     --- 2. ANÁLISIS DE TIPOS DE VALOR (Muestra de hasta 20 elementos) ---
 {type_counts}
 
     --- 3. VALORES MÁS FRECUENTES (Top 10) ---
-{series.value_counts().head(10).to_string()}
+{top_values}
 
     --- 4. ESTADÍSTICAS DESCRIPTIVAS ---
 {desc_stats}
@@ -4,6 +4,10 @@ import geopandas as gpd
 import pandas as pd
 import logging
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import shapely
 from pathlib import Path
 
 from src.diagnostics.inspector import inspect_column
@@ -21,6 +25,45 @@ def merge_agebs_with_census(agebs_gdf: gpd.GeoDataFrame, census_df: pd.DataFrame
     
     return enriched_gdf
 
+def _intersect_polygons(left_gdf: gpd.GeoDataFrame, right_gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Intersecta dos capas de polígonos con el índice espacial y operaciones vectorizadas de shapely."""
+    left_idx, right_idx = right_gdf.sindex.query(left_gdf.geometry, predicate='intersects')
+    left_geoms = left_gdf.geometry.to_numpy()[left_idx]
+    right_geoms = right_gdf.geometry.to_numpy()[right_idx]
+
+    # Si un polígono contiene al otro, la intersección es el contenido: se evita el recorte con GEOS
+    # y sólo se intersectan los pares que realmente cruzan bordes.
+    shapely.prepare(left_geoms)
+    shapely.prepare(right_geoms)
+    left_contains_right = shapely.contains(left_geoms, right_geoms)
+    right_contains_left = shapely.contains(right_geoms, left_geoms) & ~left_contains_right
+    crosses = ~(left_contains_right | right_contains_left)
+
+    fragmentos = np.empty(len(left_idx), dtype=object)
+    fragmentos[left_contains_right] = right_geoms[left_contains_right]
+    fragmentos[right_contains_left] = left_geoms[right_contains_left]
+    fragmentos[crosses] = shapely.intersection(left_geoms[crosses], right_geoms[crosses])
+    fragmento_area = shapely.area(fragmentos)
+
+    # Mismos sufijos que gpd.overlay para columnas repetidas en ambas capas.
+    left_attrs = left_gdf.drop(columns=left_gdf.geometry.name)
+    right_attrs = right_gdf.drop(columns=right_gdf.geometry.name)
+    shared_cols = left_attrs.columns.intersection(right_attrs.columns)
+    left_attrs = left_attrs.rename(columns={col: f'{col}_1' for col in shared_cols})
+    right_attrs = right_attrs.rename(columns={col: f'{col}_2' for col in shared_cols})
+
+    intersection_gdf = gpd.GeoDataFrame(
+        pd.concat([
+            left_attrs.iloc[left_idx].reset_index(drop=True),
+            right_attrs.iloc[right_idx].reset_index(drop=True)
+        ], axis=1),
+        geometry=fragmentos,
+        crs=left_gdf.crs
+    )
+    intersection_gdf['fragmento_area'] = fragmento_area
+    # Se descartan los contactos sólo por borde o vértice (área nula), como hace overlay con polígonos.
+    return intersection_gdf[fragmento_area > 0].reset_index(drop=True)
+
 def perform_areal_interpolation(units_gdf: gpd.GeoDataFrame, enriched_agebs_gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """Realiza la interpolación areal para transferir datos de AGEBs a Unidades Territoriales."""
     logging.info("Iniciando interpolación areal (overlay/intersección)... Esto puede tardar.")
@@ -28,10 +71,9 @@ def perform_areal_interpolation(units_gdf: gpd.GeoDataFrame, enriched_agebs_gdf:
     units_gdf = units_gdf[~units_gdf.geometry.is_empty & units_gdf.geometry.is_valid]
     enriched_agebs_gdf = enriched_agebs_gdf[~enriched_agebs_gdf.geometry.is_empty & enriched_agebs_gdf.geometry.is_valid]
 
-    intersection_gdf = gpd.overlay(units_gdf, enriched_agebs_gdf, how="intersection")
+    intersection_gdf = _intersect_polygons(units_gdf, enriched_agebs_gdf)
 
     logging.info("Calculando pesos de área para la ponderación.")
-    intersection_gdf['fragmento_area'] = intersection_gdf.geometry.area
     
     # --- INICIO DE LA CORRECCIÓN 1 ---
     #
@@ -39,15 +81,20 @@ def perform_areal_interpolation(units_gdf: gpd.GeoDataFrame, enriched_agebs_gdf:
     # También se ponderan tanto las columnas del Censo como las del DENUE.
     #
     intersection_gdf['ageb_area_total_safe'] = intersection_gdf['ageb_area_total'] + 1e-9
-    intersection_gdf['peso_area'] = intersection_gdf['fragmento_area'] / intersection_gdf['ageb_area_total_safe']
+    intersection_gdf['peso_area'] = (
+        intersection_gdf['fragmento_area'] / intersection_gdf['ageb_area_total_safe']
+    ).astype('float32')
 
     count_cols_to_pond = [
         'pob_total', 'viviendas_totales', 'viv_con_internet',
         'num_negocios', 'indice_diversidad'
     ]
-    for col in count_cols_to_pond:
-        if col in intersection_gdf.columns:
-            intersection_gdf[col + '_pond'] = intersection_gdf[col] * intersection_gdf['peso_area']
+    # Un solo producto con broadcasting sobre el bloque de columnas en lugar de una multiplicación por columna.
+    present_cols = [col for col in count_cols_to_pond if col in intersection_gdf.columns]
+    pond_cols = [col + '_pond' for col in present_cols]
+    intersection_gdf[pond_cols] = (
+        intersection_gdf[present_cols].to_numpy(dtype=np.float64) * intersection_gdf['peso_area'].to_numpy()[:, None]
+    )
 
     if 'escolaridad_promedio' in intersection_gdf.columns and 'pob_total_pond' in intersection_gdf.columns:
         intersection_gdf['escolaridad_x_pob'] = intersection_gdf['escolaridad_promedio'] * intersection_gdf['pob_total_pond']
@@ -57,6 +104,27 @@ def perform_areal_interpolation(units_gdf: gpd.GeoDataFrame, enriched_agebs_gdf:
     return intersection_gdf
 
 
+def _area_weighted_means(intersection_gdf: gpd.GeoDataFrame, cols: list, group_col: str) -> pd.DataFrame:
+    """Calcula promedios ponderados por 'fragmento_area' por grupo como suma(valor * área) / suma(área)."""
+    codes, keys = pd.factorize(intersection_gdf[group_col])
+    valid = codes >= 0  # Igual que groupby, se ignoran las claves nulas
+    codes = codes[valid]
+    weights = intersection_gdf['fragmento_area'].to_numpy(dtype=np.float64)[valid]
+    n_groups = len(keys)
+
+    # np.bincount acumula todas las sumas por grupo en una sola pasada lineal por columna.
+    weight_sums = np.bincount(codes, weights=weights, minlength=n_groups)
+    means = {
+        col: np.bincount(
+            codes,
+            weights=weights * intersection_gdf[col].to_numpy(dtype=np.float64)[valid],
+            minlength=n_groups
+        ) / weight_sums
+        for col in cols
+    }
+    return pd.DataFrame(means, index=pd.Index(keys, name=group_col))
+
+
 def aggregate_to_territorial_units(intersection_gdf: gpd.GeoDataFrame, epsilon: float) -> pd.DataFrame:
     """Agrega TODOS los datos ponderados a nivel de Unidad Territorial."""
     logging.info("Agregando todos los datos a nivel de Unidad Territorial.")
@@ -69,28 +137,28 @@ def aggregate_to_territorial_units(intersection_gdf: gpd.GeoDataFrame, epsilon:
         epsilon_float = 1e-9
     # --- FIN DE LA CORRECCIÓN DEFINITIVA ---
 
-    agg_dict = {
-        'pob_total_pond': 'sum',
-        'viviendas_totales_pond': 'sum',
-        'viv_con_internet_pond': 'sum',
-        'escolaridad_x_pob': 'sum',
-        'num_negocios_pond': 'sum',
-        'indice_diversidad_pond': 'sum',
-        'densidad_negocios': lambda s: np.average(s, weights=intersection_gdf.loc[s.index, 'fragmento_area']),
-        'densidad_diversidad': lambda s: np.average(s, weights=intersection_gdf.loc[s.index, 'fragmento_area']),
-        'tasa_delitos_km2': lambda s: np.average(s, weights=intersection_gdf.loc[s.index, 'fragmento_area'])
+    weighted_mean_cols = [
+        col for col in ['densidad_negocios', 'densidad_diversidad', 'tasa_delitos_km2']
+        if col in intersection_gdf.columns
+    ]
+
+    # Agregaciones con nombre: cada columna sale del groupby ya con su nombre final.
+    named_aggs = {
+        'pob_total': pd.NamedAgg('pob_total_pond', 'sum'),
+        'viviendas_totales': pd.NamedAgg('viviendas_totales_pond', 'sum'),
+        'viv_con_internet': pd.NamedAgg('viv_con_internet_pond', 'sum'),
+        'escolaridad_x_pob': pd.NamedAgg('escolaridad_x_pob', 'sum'),
+        'num_negocios': pd.NamedAgg('num_negocios_pond', 'sum'),
+        'indice_diversidad': pd.NamedAgg('indice_diversidad_pond', 'sum')
     }
     
-    final_agg_dict = {k: v for k, v in agg_dict.items() if k in intersection_gdf.columns}
-    aggregated_data = intersection_gdf.groupby('cve_unidad_territorial').agg(final_agg_dict)
-    
-    aggregated_data.rename(columns={
-        'pob_total_pond': 'pob_total',
-        'viviendas_totales_pond': 'viviendas_totales',
-        'viv_con_internet_pond': 'viv_con_internet',
-        'num_negocios_pond': 'num_negocios',
-        'indice_diversidad_pond': 'indice_diversidad'
-    }, inplace=True)
+    final_named_aggs = {k: v for k, v in named_aggs.items() if v.column in intersection_gdf.columns}
+    # sort=False evita ordenar las claves; el orden final lo define el merge con las Unidades Territoriales.
+    aggregated_data = intersection_gdf.groupby('cve_unidad_territorial', sort=False).agg(**final_named_aggs)
+
+    aggregated_data = aggregated_data.join(
+        _area_weighted_means(intersection_gdf, weighted_mean_cols, 'cve_unidad_territorial')
+    )
 
     logging.info("Calculando indicadores finales (promedios y porcentajes).")
     # Se usa la variable epsilon convertida a float
@@ -113,22 +181,23 @@ def assemble_final_gdf(units_gdf: gpd.GeoDataFrame, aggregated_data: pd.DataFram
         units_gdf,
         aggregated_data, # <--- Simplemente pasamos el DataFrame completo
         on='cve_unidad_territorial',
-        how='left'
+        how='inner'
     )
     #
     # --- FIN DE LA CORRECCIÓN ---
     
-    final_gdf.dropna(subset=['pob_total'], inplace=True) # Mantenemos esta limpieza por si acaso
+    # El merge 'inner' reemplaza al antiguo dropna(subset=['pob_total']): las únicas filas sin
+    # 'pob_total' eran Unidades Territoriales sin ningún fragmento de AGEB en 'aggregated_data'.
     
-    # Redondeamos solo las columnas que sabemos que existen y son numéricas
+    # Redondeamos solo las columnas que sabemos que existen y son numéricas, en una sola pasada
     cols_to_round = {
         'pob_total': 0,
         'escolaridad_promedio': 2,
         'porc_viv_con_internet': 2
     }
-    for col, decimals in cols_to_round.items():
-        if col in final_gdf.columns:
-            final_gdf[col] = final_gdf[col].round(decimals)
+    round_cols = [col for col in cols_to_round if col in final_gdf.columns]
+    scale = 10.0 ** np.array([cols_to_round[col] for col in round_cols])
+    final_gdf[round_cols] = np.rint(final_gdf[round_cols].to_numpy(dtype=np.float64) * scale) / scale
     
     logging.info(f"GeoDataFrame final creado con {len(final_gdf)} Unidades Territoriales.")
     return final_gdf
@@ -137,19 +206,37 @@ def assemble_final_gdf(units_gdf: gpd.GeoDataFrame, aggregated_data: pd.DataFram
 def clean_and_standardize_denue(input_path: Path, output_path: Path, estrato_map: dict):
     """Aplica limpieza y estandarización avanzada al DENUE consolidado."""
     logging.info(f"Iniciando limpieza del DENUE desde '{input_path}'...")
-    df = pd.read_parquet(input_path)
-    
-    # Filtrar coordenadas y cve_ageb nulos
-    df = df[~((df['latitud'] == 0) & (df['longitud'] == 0))]
-    df.dropna(subset=['cve_ageb'], inplace=True)
+    # Se leen sólo las columnas necesarias y el filtro de coordenadas (0, 0) y 'cve_ageb' nulo
+    # se empuja a la lectura del Parquet, sin materializar las filas descartadas.
+    dataset = ds.dataset(input_path, format='parquet')
+    read_cols = [
+        col for col in [
+            'id_denue', 'timestamp', 'latitud', 'longitud',
+            'cve_ageb', 'codigo_postal', 'cve_scian', 'personal_ocupado_estrato'
+        ]
+        if col in dataset.schema.names
+    ]
+    row_filter = pc.field('cve_ageb').is_valid() & ~((pc.field('latitud') == 0) & (pc.field('longitud') == 0))
+    df = dataset.to_table(columns=read_cols, filter=row_filter).to_pandas(types_mapper=pd.ArrowDtype)
     
     # Estandarizar estrato de personal
     if 'personal_ocupado_estrato' in df.columns:
-        source_col_norm = df['personal_ocupado_estrato'].str.lower()
-        df['estrato_personal'] = source_col_norm.map(estrato_map)
+        # Como categórica, el lowercase y la búsqueda en el mapeo se hacen sólo sobre las categorías únicas.
+        estrato_cat = df['personal_ocupado_estrato'].astype('category')
+        category_map = {
+            cat: estrato_map[cat.lower()]
+            for cat in estrato_cat.cat.categories
+            if cat.lower() in estrato_map
+        }
+        # Se regresa a cadenas Arrow para no cambiar el esquema de 'denue_limpio.parquet' a diccionario.
+        df['estrato_personal'] = estrato_cat.map(category_map).astype(pd.ArrowDtype(pa.string()))
     
-    # Asegurar formato de cve_ageb
-    df['cve_ageb'] = df['cve_ageb'].astype(str).str.split('.').str[0].str.zfill(4)
+    # Asegurar formato de cve_ageb (parte antes del '.' rellenada a 4 dígitos) con kernels de Arrow
+    cve_ageb = pa.array(df['cve_ageb']).cast(pa.string())
+    cve_ageb = pc.list_element(pc.split_pattern(cve_ageb, '.', max_splits=1), 0)
+    df['cve_ageb'] = pd.Series(
+        pc.utf8_lpad(cve_ageb, width=4, padding='0'), index=df.index, dtype=pd.ArrowDtype(pa.string())
+    )
     
     final_cols = [
         'id_denue', 'timestamp', 'latitud', 'longitud',  
@@ -160,41 +247,63 @@ def clean_and_standardize_denue(input_path: Path, output_path: Path, estrato_map
     df_clean = df[existing_cols]
     
     logging.info(f"Guardando DENUE limpio en '{output_path}'...")
-    df_clean.to_parquet(output_path, index=False)
+    # ZSTD y BYTE_STREAM_SPLIT en coordenadas flotantes: archivo más pequeño para la lectura de la fase 4.
+    # El diccionario se desactiva en esas columnas porque, si está activo, tiene prioridad sobre BYTE_STREAM_SPLIT.
+    split_cols = [col for col in ['latitud', 'longitud'] if col in df_clean.columns]
+    df_clean.to_parquet(
+        output_path,
+        index=False,
+        engine='pyarrow',
+        compression='zstd',
+        compression_level=3,
+        use_dictionary=[col for col in df_clean.columns if col not in split_cols],
+        use_byte_stream_split=split_cols
+    )
+
 
+def create_economic_features_at_ageb_level(agebs_gdf_proj: gpd.GeoDataFrame, denue_df: pd.DataFrame, target_crs: str) -> gpd.GeoDataFrame:
+    """Genera features económicos a nivel AGEB a partir de los datos del DENUE.
 
-def create_economic_features_at_ageb_level(agebs_gdf: gpd.GeoDataFrame, denue_df: pd.DataFrame, target_crs: str) -> gpd.GeoDataFrame:
-    """Genera features económicos a nivel AGEB a partir de los datos del DENUE."""
+    'agebs_gdf_proj' debe venir proyectado en 'target_crs' y con la columna 'ageb_area_km2'.
+    """
     logging.info("Generando características económicas a nivel AGEB.")
     
-    # Reproyectar GDF de AGEBs y calcular su área
-    agebs_gdf_proj = agebs_gdf.to_crs(target_crs)
-    agebs_gdf_proj['ageb_area_km2'] = agebs_gdf_proj.geometry.area / 1_000_000
-    
     # Usar solo el snapshot más reciente del DENUE y convertirlo a GeoDataFrame
     denue_actual_df = denue_df[denue_df['timestamp'] == denue_df['timestamp'].max()]
     gdf_denue_actual = gpd.GeoDataFrame(
         denue_actual_df,
-        geometry=gpd.points_from_xy(denue_actual_df.longitud, denue_actual_df.latitud, crs="EPSG:4326")
+        geometry=gpd.GeoSeries(
+            shapely.points(
+                denue_actual_df['longitud'].to_numpy(dtype=np.float64, na_value=np.nan),
+                denue_actual_df['latitud'].to_numpy(dtype=np.float64, na_value=np.nan)
+            ),
+            index=denue_actual_df.index,
+            crs="EPSG:4326"
+        ),
+        copy=False
     ).to_crs(target_crs)
 
     # --- INICIO DE LA CORRECCIÓN DEFINITIVA ---
     #
-    # Se realiza la unión espacial. La primera corrección (tener 'cve_ageb' en agebs_gdf_proj) permite que esta línea se ejecute.
+    # Se realiza la unión espacial punto-en-polígono con 'within' (permite a GEOS omitir la lógica de bordes)
+    # consultando directamente el índice espacial de 'agebs_gdf_proj', que se construye una sola vez y se
+    # comparte con los features de seguridad. A cada negocio se le asigna un código entero de 'cve_ageb',
+    # más rápido de agrupar que el string.
     #
-    gdf_joined = gpd.sjoin(gdf_denue_actual, agebs_gdf_proj[['cve_ageb', 'geometry']], how="inner", predicate='intersects')
+    ageb_keys = pd.Categorical(agebs_gdf_proj['cve_ageb'])
+    point_idx, poly_idx = agebs_gdf_proj.sindex.query(gdf_denue_actual.geometry, predicate='within')
+    gdf_joined = gdf_denue_actual.iloc[point_idx].assign(ageb_code=ageb_keys.codes[poly_idx].astype(np.int32))
     
-    #
-    # Se manejan los sufijos '_left' y '_right' que 'sjoin' crea debido a la colisión de nombres en 'cve_ageb'.
-    # Agrupamos por la clave del polígono ('cve_ageb_right'), que es la fuente geométrica autoritativa.
-    #
     logging.info("Agregando negocios por AGEB y calculando diversidad.")
-    features_ageb = gdf_joined.groupby('cve_ageb_right').agg(
-        num_negocios=('id_denue', 'count'),
+    # 'cve_scian' como categórica para que 'nunique' trabaje sobre códigos enteros.
+    gdf_joined['cve_scian'] = gdf_joined['cve_scian'].astype('category')
+    features_ageb = gdf_joined.groupby('ageb_code', sort=False, observed=True).agg(
+        num_negocios=('id_denue', 'size'),
         indice_diversidad=('cve_scian', 'nunique')
     )
     
-    # Renombramos el índice del resultado para que vuelva a ser 'cve_ageb' y poder usarlo en el merge.
+    # Se traducen los códigos enteros de vuelta a 'cve_ageb' para poder usarlo en el merge.
+    features_ageb.index = ageb_keys.categories[features_ageb.index]
     features_ageb.index.name = 'cve_ageb'
     features_ageb = features_ageb.reset_index()
     #
@@ -211,8 +320,11 @@ def create_economic_features_at_ageb_level(agebs_gdf: gpd.GeoDataFrame, denue_df
     
     return gdf_ageb_con_features
 
-def create_security_features_at_ageb_level(agebs_gdf: gpd.GeoDataFrame, crime_df: pd.DataFrame, target_crs: str, epsilon: float) -> gpd.GeoDataFrame:
-    """Calcula la tasa de delitos de alto impacto por km² a nivel de AGEB."""
+def create_security_features_at_ageb_level(agebs_gdf_proj: gpd.GeoDataFrame, crime_df: pd.DataFrame, target_crs: str, epsilon: float) -> gpd.GeoDataFrame:
+    """Calcula la tasa de delitos de alto impacto por km² a nivel de AGEB.
+
+    'agebs_gdf_proj' debe venir proyectado en 'target_crs' y con la columna 'ageb_area_km2'.
+    """
     logging.info("Agregando delitos de alto impacto a nivel de AGEB.")
 
     # --- INICIO DE LA CORRECCIÓN DEFINITIVA ---
@@ -228,25 +340,25 @@ def create_security_features_at_ageb_level(agebs_gdf: gpd.GeoDataFrame, crime_df
     #
     # --- FIN DE LA CORRECCIÓN DEFINITIVA ---
 
-    agebs_gdf_proj = agebs_gdf.to_crs(target_crs)
-    if 'ageb_area_km2' not in agebs_gdf_proj.columns:
-        agebs_gdf_proj['ageb_area_km2'] = agebs_gdf_proj['geometry'].area / 1_000_000
-    
     gdf_crimen = gpd.GeoDataFrame(
-        crime_df, 
-        geometry=gpd.points_from_xy(crime_df.longitud, crime_df.latitud, crs="EPSG:4326")
+        crime_df,
+        geometry=gpd.GeoSeries(
+            shapely.points(
+                crime_df['longitud'].to_numpy(dtype=np.float64, na_value=np.nan),
+                crime_df['latitud'].to_numpy(dtype=np.float64, na_value=np.nan)
+            ),
+            index=crime_df.index,
+            crs="EPSG:4326"
+        ),
+        copy=False
     ).to_crs(target_crs)
 
     agebs_base = agebs_gdf_proj[['cvegeo', 'ageb_area_km2', 'geometry']]
-    gdf_ageb_crimen_joined = gpd.sjoin(gdf_crimen, agebs_base, how="inner", predicate='intersects')
-    
-    conteo_delitos_ageb = gdf_ageb_crimen_joined.groupby('cvegeo')['index_right'].count()
-    
-    gdf_ageb_con_seguridad = agebs_base.merge(
-        conteo_delitos_ageb.rename('conteo_delitos_alto_impacto'), 
-        on='cvegeo', 
-        how='left'
-    ).fillna({'conteo_delitos_alto_impacto': 0})
+    # Sólo se necesita el conteo de delitos por AGEB: se consulta el índice espacial directamente
+    # y se cuentan las posiciones de polígono con bincount, sin armar el DataFrame de sjoin.
+    _, poly_idx = agebs_gdf_proj.sindex.query(gdf_crimen.geometry, predicate='within')
+    gdf_ageb_con_seguridad = agebs_base.copy()
+    gdf_ageb_con_seguridad['conteo_delitos_alto_impacto'] = np.bincount(poly_idx, minlength=len(agebs_base))
     
     gdf_ageb_con_seguridad['ageb_area_km2'] = pd.to_numeric(
         gdf_ageb_con_seguridad['ageb_area_km2'], errors='coerce'
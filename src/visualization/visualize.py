@@ -1,6 +1,12 @@
 # /src/visualization/visualize.py
 
+import json
 import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+from functools import lru_cache
+from pyproj import Transformer
 import matplotlib.pyplot as plt
 import seaborn as sns
 import folium
@@ -8,11 +14,38 @@ from folium.plugins import Fullscreen
 from pathlib import Path
 import logging
 
+@lru_cache(maxsize=None)
+def _get_transformer(source_crs, target_crs) -> Transformer:
+    """Devuelve (y cachea) el Transformer de PROJ entre dos CRS, en orden x/y."""
+    return Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
 def create_interactive_map(gdf: gpd.GeoDataFrame, output_path: Path, geo_crs: str):
     """Crea un mapa interactivo de Folium con múltiples capas y lo guarda como HTML."""
     logging.info("Creando mapa interactivo con Folium...")
-    gdf_mapa = gdf.to_crs(geo_crs)
+    # Reproyección vectorizada con un Transformer de PROJ reutilizado entre llamadas.
+    transformer = _get_transformer(gdf.crs, geo_crs)
+    gdf_mapa = gdf.set_geometry(
+        shapely.transform(
+            gdf.geometry.to_numpy(),
+            lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1]))
+        ),
+        crs=geo_crs
+    )
     gdf_mapa['cve_unidad_territorial'] = gdf_mapa['cve_unidad_territorial'].astype(str)
+    # Se simplifican los polígonos (~10 m en grados) para reducir el tamaño del HTML y el costo de render.
+    gdf_mapa['geometry'] = shapely.simplify(gdf_mapa.geometry.to_numpy(), tolerance=1e-4, preserve_topology=True)
+
+    layers = [
+        ('escolaridad_promedio', 'Escolaridad Promedio', 'Escolaridad (Años)', 'YlGnBu'),
+        ('porc_viv_con_internet', '% Viviendas con Internet', '% Viv. con Internet', 'YlOrRd'),
+        ('pob_total', 'Población Total', 'Población (Est.)', 'PuBu')
+    ]
+    layer_cols = [col for col, _, _, _ in layers]
+    # GeoJSON serializado una sola vez con sólo la clave, el nombre y los valores de las capas.
+    geo_json = json.loads(
+        gdf_mapa[['cve_unidad_territorial', 'nombre_unidad_territorial', *layer_cols, 'geometry']].to_json()
+    )
+    layer_data = pd.DataFrame(gdf_mapa[['cve_unidad_territorial', *layer_cols]])
     
     m = folium.Map(location=[19.4326, -99.1332], zoom_start=10.5, tiles=None)
     
@@ -21,15 +54,11 @@ def create_interactive_map(gdf: gpd.GeoDataFrame, output_path: Path, geo_crs: st
     folium.TileLayer('OpenStreetMap', name='Mapa Base (Calles)').add_to(m)
     
     # Capas de datos (Choropleth)
-    for col, name, legend, color in [
-        ('escolaridad_promedio', 'Escolaridad Promedio', 'Escolaridad (Años)', 'YlGnBu'),
-        ('porc_viv_con_internet', '% Viviendas con Internet', '% Viv. con Internet', 'YlOrRd'),
-        ('pob_total', 'Población Total', 'Población (Est.)', 'PuBu')
-    ]:
+    for col, name, legend, color in layers:
         choropleth = folium.Choropleth(
-            geo_data=gdf_mapa,
+            geo_data=geo_json,
             name=name,
-            data=gdf_mapa,
+            data=layer_data,
             columns=['cve_unidad_territorial', col],
             key_on='feature.properties.cve_unidad_territorial',
             fill_color=color,
@@ -3,12 +3,15 @@
 import yaml
 import logging
 from pathlib import Path
-import geopandas as gpd
+import pyogrio
 import pandas as pd
-import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from src.data.make_dataset import load_primary_attributes
+
 # --- Configuración de Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -40,26 +43,40 @@ def validate_final_dataset():
         return
         
     logging.info(f"Cargando dataset desde: {dataset_path}")
-    gdf = gpd.read_file(dataset_path)
+    # El reporte sólo usa columnas numéricas y de identificación: no se decodifican las geometrías.
+    report_cols = [
+        'cve_unidad_territorial', 'nombre_unidad_territorial', 'pob_total', 'escolaridad_promedio',
+        'porc_viv_con_internet', 'num_negocios', 'indice_diversidad', 'densidad_negocios',
+        'densidad_diversidad', 'tasa_delitos_km2'
+    ]
+    gdf = load_primary_attributes(dataset_path, report_cols)
+    dataset_crs = pyogrio.read_info(dataset_path)['crs']
 
     # --- 2. Análisis Estructural ---
     print_header("Análisis Estructural")
     print(f"Forma del dataset (filas, columnas): {gdf.shape}")
-    print(f"Sistema de Coordenadas (CRS): {gdf.crs}")
+    print(f"Sistema de Coordenadas (CRS): {dataset_crs}")
     print(f"Uso de memoria: {gdf.memory_usage(deep=True).sum() / 1e6:.2f} MB")
     print("\nColumnas y Tipos de Datos (Dtypes):")
     print(gdf.dtypes)
 
     # --- 3. Análisis de Integridad ---
     print_header("Análisis de Integridad de Datos")
-    null_counts = gdf.isnull().sum()
+    # Nulos e infinitos columna por columna con Arrow, sin construir DataFrames booleanos completos.
+    null_counts = {}
+    inf_counts = 0
+    for col in gdf.columns:
+        arr = pa.array(gdf[col], from_pandas=True)
+        null_counts[col] = arr.null_count
+        if pd.api.types.is_float_dtype(gdf[col]):
+            inf_counts += pc.sum(pc.is_inf(arr)).as_py() or 0
+    null_counts = pd.Series(null_counts)
     total_nulls = null_counts.sum()
     print(f"Conteo total de valores nulos en el dataset: {total_nulls}")
     if total_nulls > 0:
         print("Columnas con valores nulos:")
         print(null_counts[null_counts > 0])
     
-    inf_counts = np.isinf(gdf.select_dtypes(include=np.number)).sum().sum()
     print(f"Conteo total de valores infinitos en el dataset: {inf_counts}")
 
     # --- 4. Análisis Estadístico por Dimensión ---
@@ -101,13 +118,13 @@ def validate_final_dataset():
     ranking_cols = ['nombre_unidad_territorial', 'pob_total', 'num_negocios', 'tasa_delitos_km2']
     
     print("\n--- Top 5 por Población Total ---")
-    print(gdf.sort_values('pob_total', ascending=False)[ranking_cols].head(5).to_string(index=False))
+    print(gdf.nlargest(5, 'pob_total')[ranking_cols].to_string(index=False))
     
     print("\n--- Top 5 por Número de Negocios ---")
-    print(gdf.sort_values('num_negocios', ascending=False)[ranking_cols].head(5).to_string(index=False))
+    print(gdf.nlargest(5, 'num_negocios')[ranking_cols].to_string(index=False))
 
     print("\n--- Top 5 por Tasa de Delitos (más alta) ---")
-    print(gdf.sort_values('tasa_delitos_km2', ascending=False)[ranking_cols].head(5).to_string(index=False))
+    print(gdf.nlargest(5, 'tasa_delitos_km2')[ranking_cols].to_string(index=False))
 
     print("\n" + "="*80)
     logging.info("Validación finalizada exitosamente.")